@@ -14,17 +14,24 @@ kanji’s keyword/meaning pulled from a separate single-kanji deck.
 
 from __future__ import annotations
 
+import fnmatch
+import functools
 import json
 import os
-import re
+import sqlite3
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Tuple
 
+from anki.collection import Collection, OpChangesWithCount
 from anki.hooks import addHook
+from anki.utils import ids2str
 from aqt import clayout, gui_hooks, mw
 from aqt import reviewer as aqt_reviewer
+from aqt.operations import CollectionOp
 from aqt.qt import (QAction, QCheckBox, QDialog, QDialogButtonBox, QFormLayout,
-                    QLineEdit)
+                    QLineEdit, QTimer)
 from aqt.utils import showInfo, tooltip
 
 try:
@@ -39,7 +46,9 @@ except Exception:
 ADDON_NAME = __name__  # folder name
 ADDON_DIR = Path(mw.addonManager.addonsFolder()) / ADDON_NAME
 CFG_FILE = ADDON_DIR / "config.json"
-CACHE_FILE = ADDON_DIR / "kanji_cache.json"
+META_FILE = ADDON_DIR / "meta.json"  # where Anki keeps the user's config
+# user_files/ is the one add-on subfolder Anki keeps across updates
+CACHE_DB = ADDON_DIR / "user_files" / "kanji_cache.sqlite"
 
 
 def _defaults() -> Dict[str, object]:
@@ -58,9 +67,27 @@ def _defaults() -> Dict[str, object]:
     }
 
 
+_CFG_MTIME: Tuple[float, ...] = ()
+
+
+def _cfg_mtime() -> Tuple[float, ...]:
+    return tuple(f.stat().st_mtime if f.exists() else 0.0 for f in (CFG_FILE, META_FILE))
+
+
 def _load_cfg() -> Dict[str, object]:
+    global _CFG_MTIME
+    _CFG_MTIME = _cfg_mtime()
     user = mw.addonManager.getConfig(ADDON_NAME) or {}
-    return {**_defaults(), **user}
+    cfg = {**_defaults(), **user}
+    # parsed once here so per-note code never re-splits the filter string:
+    # plain entries match as substrings, entries containing "*" are
+    # shell-style wildcard patterns
+    names = [t.strip().lower() for t in str(cfg["noteTypes"]).split(",") if t.strip()]
+    cfg["_noteTypesParsed"] = (
+        tuple(t for t in names if "*" not in t),
+        tuple(t for t in names if "*" in t),
+    )
+    return cfg
 
 
 def _save_cfg(cfg: Dict[str, object]) -> None:
@@ -86,65 +113,342 @@ def log(*msg):
 # Kanji helpers
 ###############################################################################
 
-KANJI_RE = re.compile(r"[\u4E00-\u9FFF]")
+def extract_unique_kanji(text: str) -> List[str]:
+    # CJK Unified Ideographs block, order-preserving de-duplication
+    return list(dict.fromkeys(ch for ch in text if "\u4e00" <= ch <= "\u9fff"))
 
 
-def extract_unique_kanji(text: str) -> List[str]:
-    seen: Set[str] = set()
-    out: List[str] = []
-    for ch in text:
-        if KANJI_RE.fullmatch(ch) and ch not in seen:
-            seen.add(ch)
-            out.append(ch)
-    return out
+# (mid, field name) → field index; -1 when the note type lacks the field
+_FIELD_IDX: Dict[Tuple[int, str], int] = {}
+
+
+def _field_idx(mid: int, name: str) -> int:
+    key = (mid, name)
+    i = _FIELD_IDX.get(key)
+    if i is None:
+        names = mw.col.models.field_names(mw.col.models.get(mid))
+        i = names.index(name) if name in names else -1
+        _FIELD_IDX[key] = i
+    return i
+
 
+_INDEX: Dict[str, str] = {}
+_INDEX_KEY: Tuple[object, ...] = ()
 
-def lookup_meanings(kanji: List[str]) -> Dict[str, str]:
+
+def _deck_notes_sql(dids: str) -> str:
+    # notes with a card in the deck, including cards moved to filtered decks
+    return f"select nid from cards where did in {dids} or odid in {dids}"
+
+
+def _deck_state() -> Tuple[object, ...]:
+    """Identify the current contents of the target deck: the lookup config,
+    the deck ids and the note count / newest note mtime inside them."""
     deck = CFG["targetDeck"]
-    s_field = CFG["searchField"]
-    a_field = CFG["additionalField"]
     col = mw.col
-
-    log("Searching deck:", deck)
-    res: Dict[str, str] = {}
-    for k in kanji:
-        note_ids = col.find_notes(f'deck:"{deck}" "{k}"')
-        log(" ├─", k, "→ nids", note_ids)
-        for nid in note_ids:
-            note = col.get_note(nid)
-            try:
-                if note[s_field].strip() == k:
-                    try:
-                        res[k] = note[a_field].strip()
-                    except KeyError:
-                        res[k] = ""
-                    break
-            except KeyError:
-                pass
+    did = col.decks.id_for_name(deck)
+    if not did:
+        return (deck, CFG["searchField"], CFG["additionalField"], "", 0, 0)
+    dids = ids2str(col.decks.deck_and_child_ids(did))
+    count, mod = col.db.first(
+        f"select count(), coalesce(max(mod), 0) from notes where id in ({_deck_notes_sql(dids)})"
+    )
+    return (deck, CFG["searchField"], CFG["additionalField"], dids, count, mod)
+
+
+# _deck_state() as of the last check; None once a hook reports that notes,
+# decks or note types may have changed, so lookups only query it then
+_DECK_STATE: Optional[Tuple[object, ...]] = None
+
+
+def _current_deck_state() -> Tuple[object, ...]:
+    global _DECK_STATE
+    if _DECK_STATE is None:
+        _DECK_STATE = _deck_state()
+    return _DECK_STATE
+
+
+def _mark_deck_dirty() -> None:
+    global _DECK_STATE
+    _DECK_STATE = None
+
+
+def _on_collection_changed(changes, handler) -> None:
+    if changes.note_text or changes.deck or changes.notetype:
+        _mark_deck_dirty()
+
+
+gui_hooks.operation_did_execute.append(_on_collection_changed)
+gui_hooks.collection_did_load.append(lambda col: _mark_deck_dirty())
+
+
+def _build_kanji_index() -> Dict[str, str]:
+    """Map search-field value → additional-field value for the whole target
+    deck. Built with one SQL query over the notes table and reused until the
+    deck's notes or the lookup fields change."""
+    global _INDEX, _INDEX_KEY
+    key = _current_deck_state()
+    if key == _INDEX_KEY:
+        return _INDEX
+
+    deck, s_field, a_field, dids = key[:4]
+    log("Indexing deck:", deck)
+    _LAST_POPULATE.clear()  # earlier fills may have used the old deck contents
+    index: Dict[str, str] = {}
+    if not dids:
+        log("Deck not found:", deck)
+        rows = []
+    else:
+        rows = mw.col.db.all(f"select mid, flds from notes where id in ({_deck_notes_sql(dids)})")
+
+    for mid, flds in rows:
+        s_idx = _field_idx(mid, s_field)
+        if s_idx < 0:
+            continue
+        values = flds.split("\x1f")
+        k = values[s_idx].strip()
+        if not k or k in index:
+            continue
+        a_idx = _field_idx(mid, a_field)
+        index[k] = values[a_idx].strip() if a_idx >= 0 else ""
+    log("Indexed", len(index), "entries")
+    _INDEX, _INDEX_KEY = index, key
+    return index
+
+
+def lookup_meanings(kanji: List[str], index: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    idx = _build_kanji_index() if index is None else index
+    res = {k: idx[k] for k in kanji if k in idx}
     log("Lookup result:", res)
     return res
 
 
 def join_pairs(mapping: Dict[str, str]) -> str:
-    return "\u3000".join(f"{k}: {v}".strip() for k, v in mapping.items() if v)
+    return "\u3000".join([f"{k}: {v}" for k, v in mapping.items() if v])
+
+###############################################################################
+# Kanji cache
+###############################################################################
+
+def _open_cache_db() -> Optional[sqlite3.Connection]:
+    try:
+        CACHE_DB.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(CACHE_DB), check_same_thread=False)
+        db.execute("pragma journal_mode=wal")
+        db.execute("pragma synchronous=normal")
+        db.execute("create table if not exists kv (k text primary key, v text) without rowid")
+        db.execute("create table if not exists meta (k text primary key, v text) without rowid")
+    except Exception as e:
+        print("[Kanji Constituent] Cache open failed:", e)
+        return None
+    return db
+
+
+_db = _open_cache_db()
+
+
+def load_cache(keys: List[str]) -> Dict[str, str]:
+    """Read the stored entries for *keys*; absent keys are left out."""
+    if _db is not None and keys:
+        try:
+            marks = ",".join("?" * len(keys))
+            return dict(_db.execute(f"select k, v from kv where k in ({marks})", keys))
+        except Exception as e:
+            print("[Kanji Constituent] Cache load failed:", e)
+    return {}
+
+
+def save_cache(entries: Dict[str, str]) -> bool:
+    """Upsert *entries* in a single transaction; True once they are stored."""
+    if _db is None or not entries:
+        return False
+    try:
+        with _db:
+            _db.executemany("insert or replace into kv values (?, ?)", entries.items())
+        return True
+    except Exception as e:
+        print("[Kanji Constituent] Cache write failed:", e)
+        return False
+
+
+def _stored_cache_state() -> Optional[str]:
+    if _db is not None:
+        try:
+            row = _db.execute("select v from meta where k = 'deck_state'").fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            print("[Kanji Constituent] Cache load failed:", e)
+    return None
+
+
+def _check_cache_state() -> None:
+    """Drop cached meanings once the target deck no longer matches the state
+    they were looked up in (notes added, edited or removed, config changed)."""
+    global _CACHE_STATE
+    state = json.dumps(_current_deck_state(), ensure_ascii=False)
+    if state == _CACHE_STATE:
+        return
+    log("Kanji deck changed, clearing cache")
+    clear_cache()
+    _CACHE_STATE = state
+    if _db is not None:
+        try:
+            with _db:
+                _db.execute("insert or replace into meta values ('deck_state', ?)", (state,))
+        except Exception as e:
+            print("[Kanji Constituent] Cache write failed:", e)
+
+
+def clear_cache() -> None:
+    global _LAST_LOOKUP
+    KANJI_CACHE.clear()
+    _CACHE_PENDING.clear()
+    _LAST_LOOKUP = ("", "")  # its HTML was built from the cleared entries
+    _LAST_POPULATE.clear()
+    if _db is not None:
+        try:
+            with _db:
+                _db.execute("delete from kv")
+        except Exception as e:
+            print("[Kanji Constituent] Cache write failed:", e)
+
+
+KANJI_CACHE_MAX = 10000  # comfortably above Jōyō + JIS level 1
+
+# in-memory LRU tier over the SQLite store: kanji → meaning, where ""
+# marks a kanji already looked up and not found (kept in memory only)
+KANJI_CACHE: OrderedDict[str, str] = OrderedDict()
+# entries added since the last flush
+_CACHE_PENDING: Dict[str, str] = {}
+# _deck_state() the stored entries were looked up in
+_CACHE_STATE: Optional[str] = _stored_cache_state()
+
+
+def _cache_put(k: str, v: str) -> None:
+    KANJI_CACHE[k] = v
+    KANJI_CACHE.move_to_end(k)
+    if len(KANJI_CACHE) > KANJI_CACHE_MAX:
+        KANJI_CACHE.popitem(last=False)
+
+
+def flush_cache() -> None:
+    """Write entries added since the last flush to disk."""
+    if not _CACHE_PENDING:
+        return
+    # write a snapshot and only drop what was stored, so entries added
+    # meanwhile (or a failed write) stay pending for the next flush
+    entries = dict(_CACHE_PENDING)
+    if save_cache(entries):
+        for k, v in entries.items():
+            if _CACHE_PENDING.get(k) == v:
+                del _CACHE_PENDING[k]
+
+
+def lookup_with_cache_kanji(kanji: List[str]) -> Dict[str, str]:
+    result: Dict[str, str] = {}
+    new_kanji: List[str] = []
+    for k in kanji:
+        if k in KANJI_CACHE:
+            KANJI_CACHE.move_to_end(k)
+            result[k] = KANJI_CACHE[k]
+        else:
+            new_kanji.append(k)
+
+    if new_kanji:
+        stored = load_cache(new_kanji)
+        for k, v in stored.items():
+            _cache_put(k, v)
+        result.update(stored)
+
+        missing = [k for k in new_kanji if k not in stored]
+        if missing:
+            log("Not found in cache, looking up", missing)
+            meanings = lookup_meanings(missing)
+            _CACHE_PENDING.update((k, v) for k, v in meanings.items() if v)
+            for k in missing:
+                v = meanings.get(k, "")
+                _cache_put(k, v)
+                result[k] = v
+
+    return {k: result[k] for k in kanji}
+
+
+def lookup_with_cache(word: str) -> Dict[str, str]:
+    _check_cache_state()
+    result = lookup_with_cache_kanji(extract_unique_kanji(word))
+    if _CACHE_PENDING:
+        # write once control returns to the event loop, after the tooltip
+        QTimer.singleShot(0, flush_cache)
+    # "" entries only exist to stop repeat deck queries
+    return {k: v for k, v in result.items() if v}
 
 ###############################################################################
 # Populate one note
 ###############################################################################
 
-def populate(note) -> bool:
-    nt_filter = [t.strip().lower() for t in str(CFG["noteTypes"]).split(",") if t.strip()]
-    if nt_filter and not any(t in note.note_type()["name"].lower() for t in nt_filter):
-        log("Skip – note-type filtered:", note.note_type()["name"])
+# mid → (lower-cased name, source field index or -1, passes note-type filter)
+_NT_CACHE: Dict[int, Tuple[str, int, bool]] = {}
+
+
+def _note_type_info(mid: int) -> Tuple[str, int, bool]:
+    info = _NT_CACHE.get(mid)
+    if info is None:
+        name = mw.col.models.get(mid)["name"].lower()
+        substrings, patterns = CFG["_noteTypesParsed"]
+        info = (
+            name,
+            _field_idx(mid, CFG["sourceField"]),
+            (not substrings and not patterns)
+            or any(t in name for t in substrings)
+            or any(fnmatch.fnmatchcase(name, p) for p in patterns),
+        )
+        _NT_CACHE[mid] = info
+    return info
+
+
+def _clear_note_type_caches() -> None:
+    _NT_CACHE.clear()
+    _FIELD_IDX.clear()
+
+
+def _on_note_types_changed(changes, handler) -> None:
+    if changes.notetype:
+        _clear_note_type_caches()
+
+
+gui_hooks.operation_did_execute.append(_on_note_types_changed)
+gui_hooks.collection_did_load.append(lambda col: _clear_note_type_caches())
+
+
+def _note_field_idx(note, name: str) -> int:
+    """Cached index of *name* on *note*. The note-type hook keeps the cache
+    current; the O(1) check against the note's field map is a last guard so a
+    moved or renamed field is never written by position."""
+    i = _field_idx(note.mid, name)
+    entry = note._fmap.get(name)
+    actual = entry[0] if entry else -1
+    if actual != i:
+        log("Field layout changed for note type", note.mid)
+        _clear_note_type_caches()
+        _FIELD_IDX[(note.mid, name)] = actual
+    return actual
+
+
+def populate(note, index: Optional[Dict[str, str]] = None) -> bool:
+    name, _, allowed = _note_type_info(note.mid)
+    if not allowed:
+        log("Skip – note-type filtered:", name)
         return False
 
-    src = CFG["sourceField"]
-    dst = CFG["destinationField"]
-    if src not in note or dst not in note:
+    src_idx = _note_field_idx(note, CFG["sourceField"])
+    dst_idx = _note_field_idx(note, CFG["destinationField"])
+    if src_idx < 0 or dst_idx < 0:
         log("Skip – missing src/dst fields")
         return False
 
-    expr = mw.col.media.strip(note[src]).strip()
+    raw = note.fields[src_idx]
+    # media tags always start with "<" or "[sound:"; skip the regex without them
+    expr = (raw if "<" not in raw and "[" not in raw else mw.col.media.strip(raw)).strip()
     if not expr:
         log("Skip – empty expression")
         return False
@@ -154,31 +458,48 @@ def populate(note) -> bool:
         log("Skip – no kanji in", expr)
         return False
 
-    mapping = lookup_meanings(kanji)
-    if not mapping:
+    # answered from the deck index, which is rebuilt whenever the deck changes
+    mapping = lookup_meanings(kanji, index)
+    if not any(mapping.values()):
         log("Skip – no mapping found for", kanji)
         return False
 
-    note[dst] = join_pairs(mapping)
-    log("Populated →", note[dst])
+    note.fields[dst_idx] = join_pairs(mapping)
+    log("Populated →", note.fields[dst_idx])
     return True
 
 ###############################################################################
 # Hooks – automatic fill on field defocus
 ###############################################################################
 
+# note → (hash of source field, time of last populate); unsaved notes in the
+# Add dialog all have id 0, so they are keyed by object identity instead
+_LAST_POPULATE: Dict[int, Tuple[int, float]] = {}
+_LAST_POPULATE_TTL = 60.0
+
+
 def on_edit_focus(flag, note, field_idx):
     if not CFG["lookupOnAdd"]:
         return flag
-    col = mw.col
-    try:
-        src_idx = col.models.field_names(note.note_type()).index(CFG["sourceField"])
-    except ValueError:
+    src_idx = _note_field_idx(note, CFG["sourceField"])
+    if src_idx < 0 or field_idx != src_idx:
         return flag
 
-    if field_idx == src_idx:
-        log("Field defocus – trying note id", note.id)
-        populate(note)
+    now = time.monotonic()
+    for key, (_, ts) in list(_LAST_POPULATE.items()):
+        if now - ts > _LAST_POPULATE_TTL:
+            del _LAST_POPULATE[key]
+
+    key = note.id or id(note)
+    h = hash(note.fields[src_idx])
+    if _LAST_POPULATE.get(key, (None, 0.0))[0] == h:
+        log("Skip – expression unchanged for note id", note.id)
+        return flag
+
+    log("Field defocus – trying note id", note.id)
+    # only remember successful fills so a miss is retried on the next defocus
+    if populate(note):
+        _LAST_POPULATE[key] = (h, now)
     return flag
 
 if CFG["lookupOnAdd"]:
@@ -188,27 +509,48 @@ if CFG["lookupOnAdd"]:
 # Bulk action (Browser)
 ###############################################################################
 
-def bulk_add(nids: List[int]):
-    global CFG
-    CFG = _load_cfg()  # refresh settings each run
+def _bulk_fill(col: Collection, nids: List[int]) -> OpChangesWithCount:
+    """Fill every selected note and write them back as one undoable step."""
+    index = _build_kanji_index()  # one deck scan for the whole run
+    rows = col.db.all(f"select id, mid, flds from notes where id in {ids2str(nids)}")
+    total = len(rows)
+    notes = []
+    for i, (nid, mid, flds) in enumerate(rows):
+        if i % 100 == 0:
+            mw.taskman.run_on_main(
+                lambda i=i: mw.progress.update(label=f"Filling constituents {i}/{total}", value=i, max=total)
+            )
+        # rule out notes from the raw row before loading a full Note
+        _, src_idx, allowed = _note_type_info(mid)
+        if not allowed or src_idx < 0 or not extract_unique_kanji(flds.split("\x1f")[src_idx]):
+            continue
+        note = col.get_note(nid)
+        if populate(note, index):
+            notes.append(note)
+    if not notes:
+        return OpChangesWithCount(count=0)
+    pos = col.add_custom_undo_entry("Kanji bulk fill")
+    col.update_notes(notes)
+    return OpChangesWithCount(count=len(notes), changes=col.merge_undo_entries(pos))
+
+
+def bulk_add(nids: List[int], parent=None):
+    _load_cfg_if_stale()  # pick up edits made since the last run
     if not nids:
         tooltip("No notes selected")
         return
 
-    col = mw.col
-    changed = 0
-    for nid in nids:
-        note = col.get_note(nid)
-        if populate(note):
-            col.update_note(note)
-            changed += 1
-    tooltip(f"Updated {changed} notes" if changed else "No notes needed")
-    log("Bulk finished –", changed, "of", len(nids))
+    def on_done(out: OpChangesWithCount) -> None:
+        changed = out.count
+        tooltip(f"Updated {changed} notes" if changed else "No notes needed", parent=parent)
+        log("Bulk finished –", changed, "of", len(nids))
+
+    CollectionOp(parent or mw, lambda col: _bulk_fill(col, nids)).success(on_done).run_in_background()
 
 
 def browser_menu(browser):
     act = QAction(CFG["bulkActionLabel"], browser)
-    act.triggered.connect(lambda _, b=browser: bulk_add(b.selectedNotes()))
+    act.triggered.connect(lambda _, b=browser: bulk_add(b.selectedNotes(), b))
     browser.form.menuEdit.addSeparator()
     browser.form.menuEdit.addAction(act)
 
@@ -218,9 +560,28 @@ addHook("browser.setupMenus", browser_menu)
 # Options dialog
 ###############################################################################
 
-def show_options():
-    global CFG
+def _reload_cfg() -> None:
+    """Re-read the config and drop everything derived from the old one."""
+    global CFG, _LAST_LOOKUP
     CFG = _load_cfg()
+    _mark_deck_dirty()  # the lookup config is part of the deck state
+    _NT_CACHE.clear()
+    _LAST_LOOKUP = ("", "")
+    _LAST_POPULATE.clear()
+    _hover_snippet.cache_clear()
+
+
+def _load_cfg_if_stale() -> Dict[str, object]:
+    if _cfg_mtime() != _CFG_MTIME:
+        _reload_cfg()
+    return CFG
+
+
+mw.addonManager.setConfigUpdatedAction(__name__, lambda _cfg: _reload_cfg())
+
+
+def show_options():
+    _load_cfg_if_stale()
 
     dlg = QDialog(mw)
     dlg.setWindowTitle("Kanji Constituent Options")
@@ -277,191 +638,70 @@ def show_options():
     }
 
     _save_cfg(new_cfg)
-    CFG = _load_cfg()
+    _reload_cfg()
     showInfo("Kanji Constituent settings saved.")
 
-def load_cache() -> Dict[str, str]:
-    if CACHE_FILE.exists():
-        try:
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            print("[Kanji Constituent] Cache load failed:", e)
-    return {}
+# Allow reviewer, previewer, card layout (and bottom bar to be safe)
+_ALLOWED_HOVER_TYPES = tuple(
+    t for t in (aqt_reviewer.Reviewer, clayout.CardLayout, Previewer) if t is not None
+)
+# Some builds pass a ReviewerBottomBar; allow by class name
+_ALLOWED_HOVER_CLASSNAMES = frozenset({"ReviewerBottomBar"})
 
 
-def save_cache(cache: Dict[str, str]) -> None:
+@functools.lru_cache(maxsize=8)
+def _hover_snippet(font_size: str, hover_offset: str) -> str:
+    # normalise once here so hover.js gets a CSS size and a real number
+    size = "".join(c for c in font_size if c in "0123456789.")
+    fs = f"{size}px" if font_size != "auto" and size else "auto"
     try:
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[Kanji Constituent] Cache write failed:", e)
-
-
-KANJI_CACHE = load_cache()
-
-
-def lookup_with_cache(word: str) -> Dict[str, str]:
-    global KANJI_CACHE
-
-    kanji_list = extract_unique_kanji(word)
-    result: Dict[str, str] = {}
-    new_kanji: List[str] = []
-
-    # Step 1: Check cache
-    log("Checking cache")
-    for k in kanji_list:
-        if k in KANJI_CACHE:
-            result[k] = KANJI_CACHE[k]
-            log("Found in cache")
-        else:
-            new_kanji.append(k)
-
-    # Step 2: Deck lookup for missing ones
-    if new_kanji:
-        log("Not found in cache, looking up")
-        meanings = lookup_meanings(new_kanji)
-        result.update(meanings)
-        # Update cache
-        KANJI_CACHE.update(meanings)
-        save_cache(KANJI_CACHE)
-
-    return result
+        off = int(float(hover_offset.strip().removesuffix("px")))
+    except (ValueError, OverflowError):
+        off = 0
+    return (
+        f"<script>window.__KANJI_CFG__={json.dumps({'fs': fs, 'off': off})};</script>"
+        f'<script src="/_addons/{ADDON_NAME}/web/hover.js"></script>'
+    )
 
 
 def inject_hover_script(web_content, context):
     """Injects JS for Ctrl+K and context menu in reviewer/previewer."""
-    cname = type(context).__name__
-    print("[HoverDebug] injecting into:", cname)
-
-    # Allow reviewer, previewer, card layout (and bottom bar to be safe)
-    allowed_types = [aqt_reviewer.Reviewer, clayout.CardLayout]
-    if Previewer:
-        allowed_types.append(Previewer)
-
-    # Some builds pass a ReviewerBottomBar; allow by class name
-    allowed_classnames = {"ReviewerBottomBar"}
-
     if not (
-        isinstance(context, tuple(allowed_types))
-        or cname in allowed_classnames
+        isinstance(context, _ALLOWED_HOVER_TYPES)
+        or type(context).__name__ in _ALLOWED_HOVER_CLASSNAMES
     ):
         return
+    log("[HoverDebug] injecting into:", type(context).__name__)
     font_size = str(CFG.get("hoverFontSize", "auto"))
     hover_offset = str(CFG.get("hoverOffset", "0"))
-    js = f"""
-    <script>
-    (function() {{
-        if (window.__KANJI_LOOKUP_INJECTED__) return;
-        window.__KANJI_LOOKUP_INJECTED__ = true;
-
-        const HOVER_FONT_SIZE = "{font_size}";
-        const HOVER_OFFSET = "{hover_offset}";
-
-        function sendLookup(text) {{
-            if (!text) return;
-            try {{ pycmd('kanjiLookup:' + text); }} catch (e) {{ console.log(e); }}
-        }}
-
-        function getFrameDoc() {{
-            const iframe = document.querySelector('#qa');
-            if (iframe && iframe.contentDocument) return iframe.contentDocument;
-            return document;
-        }}
-
-        function getSelectionRect(doc) {{
-            if (!doc) return null;
-            const sel = doc.getSelection ? doc.getSelection() : null;
-            if (!sel || !sel.rangeCount) return null;
-            return sel.getRangeAt(0).getBoundingClientRect();
-        }}
-
-        function detectFontSize(doc) {{
-            const sel = doc.getSelection();
-            if (!sel || sel.rangeCount === 0) return null;
-            const node = sel.anchorNode && sel.anchorNode.parentElement;
-            if (!node) return null;
-            const style = doc.defaultView.getComputedStyle(node);
-            return style.fontSize || null;
-        }}
-
-        function showLookupTooltip(text, html) {{
-            const doc = getFrameDoc();
-            const rect = getSelectionRect(doc);
-            if (!rect) return;
-
-            const tip = doc.createElement('div');
-            tip.className = 'kanji-tooltip';
-            tip.innerHTML = html;
-
-            let fs = HOVER_FONT_SIZE;
-            if (fs === "auto") {{
-                const detected = detectFontSize(doc);
-                if (detected) fs = detected;
-                else fs = "16px";
-            }} else {{
-                fs = fs.replace(/[^0-9.]/g, '') + 'px';
-            }}
-
-            Object.assign(tip.style, {{
-                position: 'absolute',
-                left: rect.left + 'px',
-                top: (rect.top + doc.documentElement.scrollTop - 40 + HOVER_OFFSET) + 'px',
-                background: 'rgba(20,20,20,0.95)',
-                color: 'white',
-                padding: '6px 10px',
-                borderRadius: '8px',
-                fontSize: fs,
-                lineHeight: '1.4',
-                zIndex: 99999,
-                boxShadow: '0 2px 10px rgba(0,0,0,0.4)',
-                pointerEvents: 'none',
-                maxWidth: '90%',
-                wordWrap: 'break-word',
-                opacity: '0',
-                transition: 'opacity 0.15s ease-in'
-            }});
-
-            doc.body.appendChild(tip);
-            requestAnimationFrame(() => {{ tip.style.opacity = '1'; }});
-            setTimeout(() => {{
-                tip.style.opacity = '0';
-                setTimeout(() => tip.remove(), 200);
-            }}, 5000);
-        }}
-
-        window.AnkiHoverShow = showLookupTooltip;
-
-        document.addEventListener('keydown', function(e) {{
-            if (e.key === 'F9' || (e.ctrlKey && e.key.toLowerCase() === 'k')) {{
-                const doc = getFrameDoc();
-                const sel = doc.getSelection ? doc.getSelection().toString().trim() : '';
-                if (!sel) return;
-                sendLookup(sel);
-                e.preventDefault();
-                e.stopPropagation();
-            }}
-        }}, {{capture: true}});
-
-        console.log('[KanjiHover] script injected (font size aware)');
-    }})();
-    </script>
-    """
-    web_content.head += js
+    web_content.head += _hover_snippet(font_size, hover_offset)
+
+
+MAX_LOOKUP_CHARS = 64  # keep in sync with web/hover.js
+
+# (word, html) of the previous hover lookup
+_LAST_LOOKUP: Tuple[str, str] = ("", "")
 
 
 def on_js_command(handled, cmd, context):
+    global _LAST_LOOKUP
     if cmd.startswith("kanjiLookup:"):
-        word = cmd.split(":", 1)[1]
-        meanings = lookup_with_cache(word)
-        log(f"Meaning found:{meanings}")
-        html = "<br>".join(f"{k}: {v}" for k, v in meanings.items() if v) or f"No kanji found in '{word}'."
+        word = cmd.split(":", 1)[1][:MAX_LOOKUP_CHARS]
+        _check_cache_state()  # may reset _LAST_LOOKUP; no col access unless dirty
+        if word and word == _LAST_LOOKUP[0]:
+            html = _LAST_LOOKUP[1]
+        else:
+            meanings = lookup_with_cache(word)
+            log(f"Meaning found:{meanings}")
+            html = "<br>".join(f"{k}: {v}" for k, v in meanings.items()) or f"No kanji found in '{word}'."
+            _LAST_LOOKUP = (word, html)
         js = f"if (window.AnkiHoverShow) window.AnkiHoverShow({json.dumps(word)}, {json.dumps(html)});"
         context.web.eval(js)
         return (True, None)
     return handled
 
 
+mw.addonManager.setWebExports(__name__, r"web/.*")
 gui_hooks.webview_will_set_content.append(inject_hover_script)
 gui_hooks.webview_did_receive_js_message.append(on_js_command)
 
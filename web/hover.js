@@ -0,0 +1,106 @@
+(function() {
+    if (window.__KANJI_LOOKUP_INJECTED__) return;
+    window.__KANJI_LOOKUP_INJECTED__ = true;
+
+    const CFG = window.__KANJI_CFG__ || {};
+    const HOVER_FONT_SIZE = CFG.fs || "auto";  // "auto" or e.g. "18px"
+    const HOVER_OFFSET = Number(CFG.off) || 0;
+    const MAX_LOOKUP_CHARS = 64;  // keep in sync with __init__.py
+    const KANJI_RE = /[\u4e00-\u9fff]/g;
+
+    function sendLookup(text) {
+        if (!text) return;
+        try { pycmd('kanjiLookup:' + text); } catch (e) { console.log(e); }
+    }
+
+    function getFrameDoc() {
+        const iframe = document.querySelector('#qa');
+        if (iframe && iframe.contentDocument) return iframe.contentDocument;
+        return document;
+    }
+
+    function getSelectionRect(doc) {
+        if (!doc) return null;
+        const sel = doc.getSelection ? doc.getSelection() : null;
+        if (!sel || !sel.rangeCount) return null;
+        return sel.getRangeAt(0).getBoundingClientRect();
+    }
+
+    // Resolve the card's font size once per render instead of on every
+    // lookup; getComputedStyle forces a style recalculation.
+    function cacheFontSize() {
+        const doc = getFrameDoc();
+        if (!doc.body) return;
+        const fs = doc.defaultView.getComputedStyle(doc.body).fontSize;
+        doc.documentElement.style.setProperty('--kanji-hover-fs', fs);
+    }
+
+    function scheduleFontSize() {
+        (window.requestIdleCallback || setTimeout)(cacheFontSize);
+    }
+
+    function showLookupTooltip(text, html) {
+        const doc = getFrameDoc();
+        const rect = getSelectionRect(doc);
+        if (!rect) return;
+
+        const tip = doc.createElement('div');
+        tip.className = 'kanji-tooltip';
+        tip.innerHTML = html;
+
+        let fs = HOVER_FONT_SIZE;
+        if (fs === "auto") {
+            fs = doc.documentElement.style.getPropertyValue('--kanji-hover-fs') || "16px";
+        }
+
+        Object.assign(tip.style, {
+            position: 'absolute',
+            left: rect.left + 'px',
+            top: (rect.top + doc.documentElement.scrollTop - 40 + HOVER_OFFSET) + 'px',
+            background: 'rgba(20,20,20,0.95)',
+            color: 'white',
+            padding: '6px 10px',
+            borderRadius: '8px',
+            fontSize: fs,
+            lineHeight: '1.4',
+            zIndex: 99999,
+            boxShadow: '0 2px 10px rgba(0,0,0,0.4)',
+            pointerEvents: 'none',
+            maxWidth: '90%',
+            wordWrap: 'break-word',
+            opacity: '0',
+            transition: 'opacity 0.15s ease-in'
+        });
+
+        doc.body.appendChild(tip);
+        requestAnimationFrame(() => { tip.style.opacity = '1'; });
+        setTimeout(() => {
+            tip.style.opacity = '0';
+            setTimeout(() => tip.remove(), 200);
+        }, 5000);
+    }
+
+    window.AnkiHoverShow = showLookupTooltip;
+
+    if (HOVER_FONT_SIZE === "auto") {
+        scheduleFontSize();
+        // the reviewer swaps cards without reloading the page
+        if (window.onShownHook) window.onShownHook.push(scheduleFontSize);
+    }
+
+    document.addEventListener('keydown', function(e) {
+        if (e.key === 'F9' || (e.ctrlKey && e.key.toLowerCase() === 'k')) {
+            const doc = getFrameDoc();
+            const sel = doc.getSelection ? doc.getSelection().toString().trim() : '';
+            if (!sel) return;
+            // only unique kanji reach Python; the deck holds nothing else
+            const kanji = Array.from(new Set(sel.slice(0, MAX_LOOKUP_CHARS).match(KANJI_RE) || []));
+            if (kanji.length) sendLookup(kanji.join(''));
+            else showLookupTooltip(sel, 'No kanji found.');
+            e.preventDefault();
+            e.stopPropagation();
+        }
+    }, {capture: true});
+
+    console.log('[KanjiHover] script injected (font size aware)');
+})();